@@ -1,18 +1,78 @@
 import streamlit as st
 import yfinance as yf
 import pandas as pd
-from openai import OpenAI
-import plotly.express as px
+import numpy as np
+from openai import OpenAI, OpenAIError
+import plotly.graph_objects as go
+import json
+import random
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Initialize OpenAI client with API key (replace with your actual key as needed)
+# Upper bound on tickers in one comparison, which keeps the single completion short
+MAX_COMPARE_TICKERS = 8
 
-client = OpenAI(api_key=st.secrets["openai_api_key"])
+# Fields returned per ticker by compare_stocks, with the headings they're shown under
+COMPARISON_FIELDS = {
+    "summary": "📝 Recent prices",
+    "explanation": "🧠 Key metrics",
+    "sentiment": "🤔 Should I buy this?",
+}
 
-@st.cache_data(ttl=3600)
+# Yahoo-style symbols, e.g. AAPL, BRK-B, 0700.HK, ^GSPC, EURUSD=X
+TICKER_RE = re.compile(r"^\^?[A-Z0-9][A-Z0-9.\-=]{0,9}$")
+
+# Matches "- Term:" list items in the explanation so the term can be bolded
+BOLD_METRIC_RE = re.compile(r"- ([^:]+):")
+
+# Secrets are resolved once per process rather than on every rerun
+@st.cache_resource
+def _secrets():
+    return {
+        "openai_api_key": st.secrets["openai_api_key"],
+        "openai_model": st.secrets.get("openai_model", "gpt-4o-mini"),
+    }
+
+# Chat model used for all completions, overridable through secrets
+MODEL = _secrets()["openai_model"]
+
+# OpenAI client built from the openai_api_key secret, cached as a resource so
+# reruns keep the same client and its connection pool
+@st.cache_resource
+def get_openai_client():
+    return OpenAI(api_key=_secrets()["openai_api_key"], timeout=30, max_retries=2)
+
+# Caps in-flight completions across all sessions so bursts stay under the rate limit;
+# a 429 that still gets through is retried by the client, which honours Retry-After
+@st.cache_resource
+def _completion_slots():
+    return threading.BoundedSemaphore(4)
+
+def _complete(prompt, max_tokens, temperature=1, **options):
+    with _completion_slots():
+        response = get_openai_client().chat.completions.create(
+            model=MODEL,
+            messages=[{"role": "system", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            **options
+        )
+    return response.choices[0]
+
+def _chat(prompt, max_tokens, temperature=1):
+    choice = _complete(prompt, max_tokens, temperature)
+    # Errors are raised rather than returned so a cut-off or empty reply is never cached
+    if choice.finish_reason != "stop":
+        raise ValueError(f"the reply was cut off ({choice.finish_reason})")
+    if choice.message.content is None:
+        raise ValueError("the model returned no text")
+    return choice.message.content
+
+@st.cache_data(ttl=3600, max_entries=1024, show_spinner=False)
 def get_stock_data(ticker, period="1mo", interval="1d"):
     stock = yf.Ticker(ticker)
-    history = stock.history(period=period, interval=interval)
+    history = stock.history(period=period, interval=interval, actions=False)
     return history
 
 def extract_key_metrics(info):
@@ -27,55 +87,123 @@ def extract_key_metrics(info):
         "1-Year Target Estimate": info.get("targetMeanPrice", "N/A")
     }
 
-@st.cache_data(ttl=3600)
-def generate_explanation(ticker, metrics):
-    metric_text = "\n".join([f"- {k}: {v}" for k, v in metrics.items()])
+# Only the displayed metrics are cached, not the full quote-summary payload
+@st.cache_data(ttl=3600, max_entries=1024, show_spinner=False)
+def get_stock_info(ticker):
+    return extract_key_metrics(yf.Ticker(ticker).info)
+
+# Kept in memory with a TTL: the metric text carries live quotes such as Bid,
+# so persisted entries would pile up on disk with nothing to evict them
+@st.cache_data(ttl=3600, max_entries=1024, show_spinner=False)
+def generate_explanation(ticker, metric_text):
     prompt = (
         f"A user has looked up the stock {ticker}. Here are some key metrics:\n"
         f"{metric_text}\n\n"
         "Please explain each term and its value in simple terms suitable for someone new to investing."
     )
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "system", "content": prompt}]
-    )
-    return response.choices[0].message.content
+    return _chat(prompt, max_tokens=800)
 
-@st.cache_data(ttl=3600)
-def summarize_stock_data(ticker, history):
+# Price answers are keyed on their full prompt inputs, so they stay valid across restarts;
+# max_entries only bounds the in-memory layer, the disk copies go with Clear Cache
+@st.cache_data(persist="disk", max_entries=1024, show_spinner=False)
+def summarize_stock_data(ticker, recent_prices):
     prompt = (
-        f"Based on recent stock data for {ticker}, summarize the short-term price trend and potential risks. "
+        f"Based on recent stock data for {ticker}:\n"
+        f"{recent_prices}\n\n"
+        "Summarize the short-term price trend and potential risks. "
         "Keep it short and simple, no more than 2-3 sentences, suitable for a beginner investor."
     )
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "system", "content": prompt}]
-    )
-    return response.choices[0].message.content
+    return _chat(prompt, max_tokens=150, temperature=0.3)
 
-def generate_sentiment(ticker, history):
+@st.cache_data(persist="disk", max_entries=1024, show_spinner=False)
+def generate_sentiment(ticker, recent_prices):
     prompt = (
         f"A beginner investor is considering buying {ticker}. Based on this stock's recent price data:\n"
-        f"{history.tail(5).to_string()}\n\n"
+        f"{recent_prices}\n\n"
         "Give a short 2-3 sentence reaction summarizing the investment appeal, risk level, and outlook in a casual tone."
     )
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "system", "content": prompt}]
-    )
-    return response.choices[0].message.content
+    return _chat(prompt, max_tokens=150)
 
-@st.cache_data(ttl=3600)
-def get_random_stock_fact():
+# One completion covers every ticker in the comparison instead of three calls per ticker
+@st.cache_data(persist="disk", max_entries=1024, show_spinner=False)
+def compare_stocks(ticker_rows):
     prompt = (
-        "Give me one short, surprising, or educational stock market fact that a beginner investor might not know. "
-        "Make it fun and easy to remember."
+        "A beginner investor is comparing these stocks. Each line gives a ticker, its closing prices "
+        "for the last five trading days and some key metrics:\n"
+        f"{ticker_rows}\n\n"
+        "Reply with a JSON object that maps each ticker to an object with three string fields: "
+        "\"explanation\" (what its key metrics say, in simple terms), \"summary\" (its short-term price trend "
+        "and potential risks) and \"sentiment\" (a casual take on its investment appeal and outlook). "
+        "Keep each field to 1-2 sentences suitable for someone new to investing."
     )
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "system", "content": prompt}]
+    choice = _complete(
+        prompt,
+        max_tokens=250 * len(ticker_rows.splitlines()),
+        response_format={"type": "json_object"}
     )
-    return response.choices[0].message.content
+    # Errors are raised rather than returned so a bad reply is never cached
+    if choice.finish_reason != "stop":
+        raise ValueError(f"the reply was cut off ({choice.finish_reason})")
+    try:
+        comparison = json.loads(choice.message.content)
+    except (ValueError, TypeError):
+        raise ValueError("the reply wasn't valid JSON") from None
+    if not isinstance(comparison, dict) or not all(
+        isinstance(take, dict) and all(isinstance(take.get(field), str) for field in COMPARISON_FIELDS)
+        for take in comparison.values()
+    ):
+        raise ValueError("the reply didn't have the expected shape")
+    return {t: {field: take[field] for field in COMPARISON_FIELDS} for t, take in comparison.items()}
+
+# Beginner-friendly facts shown while a ticker is entered, served locally instead of asking the LLM
+STOCK_FACTS = (
+    "The New York Stock Exchange traces its roots to 1792, when 24 brokers signed the Buttonwood Agreement under a tree on Wall Street.",
+    "A bull market is one that's rising and a bear market is one that's falling: bulls thrust their horns up, bears swipe their paws down.",
+    "Ticker symbols are named after the ticker tape machines that printed stock prices on strips of paper starting in the 1860s.",
+    "Owning a share of stock makes you a part-owner of the company, with a claim on a slice of its profits.",
+    "An S&P 500 index fund spreads your money across about 500 of the largest US companies in a single purchase.",
+    "The Rule of 72: divide 72 by your yearly return to estimate how many years it takes your money to double.",
+    "When you reinvest dividends, those new shares pay dividends too. That snowball effect is compounding.",
+    "A stock split gives you more shares at a lower price each, but the total value of what you own stays the same.",
+    "Market cap is share price times number of shares, so a $10 stock can belong to a bigger company than a $500 stock.",
+    "Most US companies that pay dividends pay them every quarter.",
+    "Over long periods, most actively managed funds fail to beat the index they're measured against.",
+    "On Black Monday, October 19, 1987, the Dow fell about 22.6% in a single day, still its biggest one-day percentage drop.",
+    "If the S&P 500 falls 7% in a day, US exchanges pause all trading for 15 minutes to let everyone catch their breath.",
+    "The Dow Jones Industrial Average tracks just 30 companies, and it's weighted by share price rather than company size.",
+    "Berkshire Hathaway's Class A shares have never been split, which is why a single share costs hundreds of thousands of dollars.",
+    "Regular US stock market hours are 9:30 a.m. to 4:00 p.m. Eastern Time, Monday through Friday.",
+    "A P/E ratio tells you how many dollars investors are paying for each dollar of a company's yearly earnings.",
+    "Dollar-cost averaging means investing the same amount on a schedule, so you automatically buy more shares when prices are low.",
+    "The bid is the most a buyer will pay, the ask is the least a seller will take, and the gap between them is the spread.",
+    "An ETF trades like a single stock but can hold hundreds or even thousands of different companies.",
+    "If you buy a stock on or after its ex-dividend date, you won't get the next dividend payment.",
+    "The Nasdaq, which opened in 1971, was the world's first electronic stock market.",
+    "Spreading your money across many companies limits how much damage any single stock can do to your portfolio.",
+    "Some of the market's best days come right after its worst ones, so selling in a panic can mean missing the rebound.",
+    "Blue-chip stocks are named after the blue chips in poker, which traditionally carry the highest value.",
+    "Many brokers offer fractional shares, so you can own a slice of an expensive stock for just a few dollars.",
+    "Since May 2024, most US stock trades settle one business day after you place them.",
+    "Trading volume is the number of shares that change hands, and big spikes often come with big news.",
+    "A company's earnings report, released every quarter, can move its stock price more than almost anything else.",
+    "The price you see for a stock is simply the last price at which a buyer and a seller agreed to trade.",
+)
+
+def get_random_stock_fact():
+    return random.choice(STOCK_FACTS)
+
+# Green for the best day, red for the worst, applied in a single Styler pass
+def highlight_daily_change(column):
+    colors = np.where(column == column.max(), "background-color: green", "")
+    return np.where(column == column.min(), "background-color: red", colors)
+
+# A fragment, so "New fact" reruns only this block instead of the whole page;
+# the fact stays the same across full reruns until the user asks for another one
+@st.fragment
+def show_stock_fact():
+    if st.button("🎲 New fact") or "fact" not in st.session_state:
+        st.session_state.fact = get_random_stock_fact()
+    st.info(f"💡 Did you know? {st.session_state.fact}")
 
 # Title
 st.markdown(
@@ -87,54 +215,162 @@ if st.button('🔄 Clear Cache'):
     st.cache_data.clear()
     st.success("Cache cleared! Please rerun the app.")
 
-ticker = st.text_input("Enter a stock ticker (e.g., AAPL, TSLA, AMZN):")
+# Typing inside a form doesn't rerun the script; only submitting does
+with st.form("query"):
+    ticker = st.text_input("Enter a stock ticker (e.g., AAPL, TSLA, AMZN):").strip().upper()
+    submitted = st.form_submit_button("Get Insights")
 
 if ticker:
-    st.info(f"💡 Did you know? {get_random_stock_fact()}")
+    show_stock_fact()
 
-if st.button("Get Insights"):
-    if ticker:
-        stock_data = get_stock_data(ticker)
-        info = yf.Ticker(ticker).info
-        key_metrics = extract_key_metrics(info)
+# Each section keeps its latest results in session state, so submitting one form
+# (or clicking any other button) doesn't wipe what the other one is showing
+if submitted:
+    if ticker and not TICKER_RE.match(ticker):
+        st.session_state.pop("insights", None)
+        st.error(f"\"{ticker}\" doesn't look like a stock ticker. Try something like AAPL or BRK-B.")
+    elif ticker:
+        # Fetch price history and company info together, and start each completion
+        # as soon as the data it needs has arrived rather than waiting for both
+        try:
+            with st.spinner("Fetching market data and generating insights..."):
+                with ThreadPoolExecutor(max_workers=3) as executor:
+                    stock_data_future = executor.submit(get_stock_data, ticker)
+                    info_future = executor.submit(get_stock_info, ticker)
+                    for future in as_completed([stock_data_future, info_future]):
+                        if future is info_future:
+                            key_metrics = info_future.result()
+                            metric_text = "\n".join([f"- {k}: {v}" for k, v in key_metrics.items()])
+                            explanation_future = executor.submit(generate_explanation, ticker, metric_text)
+                        else:
+                            stock_data = stock_data_future.result()
+                            # yfinance returns an empty frame instead of raising for unknown symbols;
+                            # don't ask the model about prices that don't exist
+                            if stock_data.empty:
+                                break
+                            recent_prices = stock_data.tail(5).to_string()
+                            summary_future = executor.submit(summarize_stock_data, ticker, recent_prices)
+                            sentiment_future = executor.submit(generate_sentiment, ticker, recent_prices)
+                    if not stock_data.empty:
+                        summary = summary_future.result()
+                        explanation = explanation_future.result()
+                        sentiment = sentiment_future.result()
+        except (OpenAIError, ValueError) as e:
+            st.session_state.pop("insights", None)
+            st.error(f"Couldn't generate insights right now: {e}")
+        else:
+            if stock_data.empty:
+                st.session_state.pop("insights", None)
+                st.error(f"No price data found for \"{ticker}\". Check the symbol and try again.")
+            else:
+                # Prepare recent data for display
+                closes = stock_data["Close"].to_numpy()[-5:]
+                daily_change = np.zeros_like(closes)
+                np.divide(np.diff(closes), closes[:-1], out=daily_change[1:])
+                daily_change *= 100
+                np.round(daily_change, 2, out=daily_change)
+                recent = stock_data.tail(5).assign(**{"Daily Change %": daily_change})
 
-        summary = summarize_stock_data(ticker, stock_data)
-        explanation = generate_explanation(ticker, key_metrics)
-        sentiment = generate_sentiment(ticker, stock_data)
+                st.session_state.insights = {
+                    "ticker": ticker,
+                    "stock_data": stock_data,
+                    "recent": recent,
+                    "key_metrics": key_metrics,
+                    "summary": summary,
+                    "explanation": explanation,
+                    "sentiment": sentiment,
+                }
 
-        # Prepare recent data for display
-        recent = stock_data.tail(5).copy()
-        recent["Daily Change %"] = recent["Close"].pct_change().fillna(0) * 100
-        recent["Daily Change %"] = recent["Daily Change %"].round(2)
+insights = st.session_state.get("insights")
+if insights:
+    stock_data = insights["stock_data"]
 
-        # Create interactive charts for price trend and volume
-        price_trend_fig = px.line(stock_data, x=stock_data.index, y='Close', title=f"{ticker.upper()} - Closing Price Over Time")
-        volume_fig = px.bar(stock_data, x=stock_data.index, y='Volume', title=f"{ticker.upper()} - Daily Trading Volume")
+    # Create interactive charts for price trend and volume
+    price_trend_fig = go.Figure(
+        go.Scattergl(x=stock_data.index, y=stock_data["Close"].to_numpy(), mode="lines"),
+        layout=dict(title=f"{insights['ticker']} - Closing Price Over Time", xaxis_title="Date", yaxis_title="Close")
+    )
+    volume_fig = go.Figure(
+        go.Bar(x=stock_data.index, y=stock_data["Volume"].to_numpy()),
+        layout=dict(title=f"{insights['ticker']} - Daily Trading Volume", xaxis_title="Date", yaxis_title="Volume")
+    )
 
-        # Highlight key terms in the explanation
-        bolded_explanation = re.sub(r"- ([^:]+):", r"- **\1**:", explanation)
+    # Highlight key terms in the explanation
+    bolded_explanation = BOLD_METRIC_RE.sub(r"- **\1**:", insights["explanation"])
 
-        tab1, tab2 = st.tabs(["📊 Basics", "💡 Insights"])
+    tab1, tab2 = st.tabs(["📊 Basics", "💡 Insights"])
 
-        with tab1:
-            st.subheader("🧠 Explanation of Key Terms You Really Need in the Market")
-            st.markdown(bolded_explanation)
+    with tab1:
+        st.subheader("🧠 Explanation of Key Terms You Really Need in the Market")
+        st.markdown(bolded_explanation)
 
-        st.subheader("📌 Recent Stock Data")
-        st.dataframe(
-            recent.style.highlight_max(subset=['Daily Change %'], color='green')
-                         .highlight_min(subset=['Daily Change %'], color='red')
-        )
+    st.subheader("📌 Recent Stock Data")
+    st.dataframe(insights["recent"].style.apply(highlight_daily_change, subset=['Daily Change %']))
+
+    with tab2:
+        st.plotly_chart(price_trend_fig)
+        st.plotly_chart(volume_fig)
+
+        st.subheader("📝 Summary of Recent Prices")
+        st.write(insights["summary"])
+
+        st.subheader("🤔 Should I Buy This?")
+        st.info(insights["sentiment"])
+
+        st.subheader("📊 Key Metrics")
+        st.json(insights["key_metrics"])
+
+with st.expander("⚖️ Compare several stocks"):
+    with st.form("compare"):
+        compare_input = st.text_input("Enter tickers separated by commas (e.g., AAPL, MSFT, TSLA):")
+        compare_submitted = st.form_submit_button("Compare")
 
-        with tab2:
-            st.plotly_chart(price_trend_fig)
-            st.plotly_chart(volume_fig)
+    if compare_submitted:
+        st.session_state.pop("comparison", None)
+        compare_tickers = list(dict.fromkeys(t.strip().upper() for t in compare_input.split(",") if t.strip()))
+        invalid = [t for t in compare_tickers if not TICKER_RE.match(t)]
+        if invalid:
+            st.error(f"These don't look like stock tickers: {', '.join(invalid)}")
+        elif not 2 <= len(compare_tickers) <= MAX_COMPARE_TICKERS:
+            st.error(f"Enter between 2 and {MAX_COMPARE_TICKERS} tickers to compare.")
+        else:
+            with st.spinner("Comparing stocks..."):
+                with ThreadPoolExecutor(max_workers=2 * len(compare_tickers)) as executor:
+                    history_futures = [executor.submit(get_stock_data, t) for t in compare_tickers]
+                    info_futures = [executor.submit(get_stock_info, t) for t in compare_tickers]
+                    histories = [future.result() for future in history_futures]
+                    metrics = [future.result() for future in info_futures]
 
-            st.subheader("📝 Summary of Recent Prices")
-            st.write(summary)
+                # Unknown symbols come back with no price history; leave them out rather than
+                # letting the model make up a take on an empty row
+                missing = [t for t, history in zip(compare_tickers, histories) if history.empty]
+                found = [row for row in zip(compare_tickers, histories, metrics) if not row[1].empty]
+                if missing:
+                    st.warning(f"No price data found for {', '.join(missing)}, so they were left out.")
 
-            st.subheader("🤔 Should I Buy This?")
-            st.info(sentiment)
+                if len(found) < 2:
+                    st.error("At least two tickers with price data are needed for a comparison.")
+                else:
+                    ticker_rows = "\n".join(
+                        f"{t}: closes " + ", ".join(f"{c:.2f}" for c in history["Close"].to_numpy()[-5:])
+                        + "; " + "; ".join(f"{k}: {v}" for k, v in key_metrics.items())
+                        for t, history, key_metrics in found
+                    )
+                    try:
+                        st.session_state.comparison = {
+                            "tickers": [t for t, _, _ in found],
+                            "takes": compare_stocks(ticker_rows),
+                        }
+                    except (OpenAIError, ValueError) as e:
+                        st.error(f"Couldn't compare these stocks right now: {e}")
 
-            st.subheader("📊 Key Metrics")
-            st.json(key_metrics)
+    comparison = st.session_state.get("comparison")
+    if comparison:
+        for t in comparison["tickers"]:
+            st.subheader(t)
+            take = comparison["takes"].get(t)
+            if take is None:
+                st.write("No comparison was returned for this ticker.")
+                continue
+            for field, heading in COMPARISON_FIELDS.items():
+                st.markdown(f"**{heading}:** {take[field]}")